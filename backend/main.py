@@ -3,8 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Optional
 import os
-import uuid
+import hashlib
 import boto3
 import logging
 from passlib.hash import bcrypt
@@ -129,8 +130,103 @@ def detect_data_type(filename: str) -> str:
     }
     return extension_map.get(ext, "Unknown")
 
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+def compute_content_hash(fileobj):
+    """Stream a file object through SHA-256, returning (hex digest, size in bytes)."""
+    hasher = hashlib.sha256()
+    file_size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+        file_size += len(chunk)
+    fileobj.seek(0)
+    return hasher.hexdigest(), file_size
+
+def find_profile_by_hash(db: Session, content_hash: str, user_id: Optional[str] = None):
+    query = db.query(DataProfile).filter(DataProfile.content_hash == content_hash)
+    if user_id is not None:
+        # Restrict to datasets held in the user's own projects
+        query = query.join(Project, DataProfile.project_id == Project.project_id).filter(Project.user_id == user_id)
+    return query.first()
+
+def create_dataset_records(db: Session, project_id: str, profile_name: str, dataset_name: str,
+                           dataset_type: str, file_url: str, file_size: int, record_count: str,
+                           content_hash: str):
+    # Create DataProfile
+    new_profile = DataProfile(
+        dataset_name=dataset_name,
+        profile_name=profile_name,
+        dataset_type=dataset_type,
+        file_path=file_url,
+        file_size=file_size,
+        record_count=record_count,
+        content_hash=content_hash,
+        project_id=project_id,
+    )
+    db.add(new_profile)
+    db.commit()
+    db.refresh(new_profile)
+
+    # Create corresponding DataNode with default x,y values
+    new_data_node = DataNode(
+        x=100.0,
+        y=100.0,
+        project_id=project_id,
+        data_profile_id=new_profile.profile_id,
+        connected_nodes=[]
+    )
+    db.add(new_data_node)
+    db.commit()
+    return new_profile
+
+@app.get("/datasets/lookup")
+def lookup_dataset(content_hash: str, user_id: str, db: Session = Depends(get_db)):
+    existing = find_profile_by_hash(db, content_hash.lower(), user_id)
+    if not existing:
+        return {"exists": False}
+    return {
+        "exists": True,
+        "file_size": existing.file_size,
+        "detected_data_type": existing.dataset_type.value,
+    }
+
+class LinkDataset(BaseModel):
+    content_hash: str
+    dataset_name: str
+    profile_name: str
+
+@app.post("/link_dataset/{project_id}")
+def link_dataset(project_id: str, link: LinkDataset, db: Session = Depends(get_db)):
+    project = db.query(Project).filter(Project.project_id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    existing = find_profile_by_hash(db, link.content_hash.lower(), project.user_id)
+    if not existing:
+        raise HTTPException(status_code=404, detail="No stored dataset matches this content hash")
+
+    new_profile = create_dataset_records(
+        db,
+        project_id=project_id,
+        profile_name=link.profile_name,
+        dataset_name=link.dataset_name,
+        dataset_type=existing.dataset_type,
+        file_url=existing.file_path,
+        file_size=existing.file_size,
+        record_count=existing.record_count,
+        content_hash=existing.content_hash,
+    )
+    return {
+        "message": "Existing dataset linked successfully",
+        "dataset_id": new_profile.profile_id,
+        "detected_data_type": existing.dataset_type.value,
+        "deduplicated": True
+    }
+
+# Plain def so FastAPI runs the hashing pass and S3 upload in its threadpool
 @app.post("/upload_dataset/{project_id}")
-async def upload_dataset(
+def upload_dataset(
     project_id: str,
     file: UploadFile = File(...),
     profile_name: str = Form(...),
@@ -140,57 +236,76 @@ async def upload_dataset(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    dataset_id = str(uuid.uuid4())
-    s3_path = f"projects/{project_id}/dataset/{dataset_id}/{file.filename}"
-
     try:
-        file.file.seek(0, os.SEEK_END)
-        file_size = file.file.tell()
-        file.file.seek(0)
-
-        s3_client.upload_fileobj(file.file, S3_BUCKET_NAME, s3_path)
-        file_url = f"https://{S3_BUCKET_NAME}.s3.{S3_REGION}.amazonaws.com/{s3_path}"
-
-        data_type_str = detect_data_type(file.filename)
-        # Create DataProfile
-        new_profile = DataProfile(
-            dataset_name=file.filename,
+        content_hash, file_size = compute_content_hash(file.file)
+
+        data_type = detect_data_type(file.filename)
+
+        # Identical content already stored by this user: reuse the object and its profiling results
+        existing = find_profile_by_hash(db, content_hash, project.user_id)
+        if existing:
+            file_url = existing.file_path
+            record_count = existing.record_count
+        else:
+            s3_path = f"datasets/{content_hash}/{file.filename}"
+            s3_client.upload_fileobj(file.file, S3_BUCKET_NAME, s3_path)
+            file_url = f"https://{S3_BUCKET_NAME}.s3.{S3_REGION}.amazonaws.com/{s3_path}"
+            record_count = "0"
+
+        new_profile = create_dataset_records(
+            db,
+            project_id=project_id,
             profile_name=profile_name,
-            dataset_type=data_type_str,
-            file_path=file_url,
+            dataset_name=file.filename,
+            dataset_type=data_type,
+            file_url=file_url,
             file_size=file_size,
-            record_count="0",
-            project_id=project_id,
-        )
-        db.add(new_profile)
-        db.commit()
-        db.refresh(new_profile)
-
-        # Create corresponding DataNode with default x,y values
-        new_data_node = DataNode(
-            x=100.0,
-            y=100.0,
-            project_id=project_id,
-            data_profile_id=new_profile.profile_id,
-            connected_nodes=[]
+            record_count=record_count,
+            content_hash=content_hash,
         )
-        db.add(new_data_node)
-        db.commit()
 
         return {
             "message": "File uploaded and profiled successfully",
             "dataset_id": new_profile.profile_id,
             "file_url": file_url,
-            "detected_data_type": data_type_str
+            "detected_data_type": data_type,
+            "deduplicated": existing is not None
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
 # Pipeline Stage Creation
+STAGE_EXECUTION_MODES = {"single", "row_wise", "partitioned"}
+
+# Shared with the execution container (see docker-compose.yml)
+SCRIPTS_DIR = "scripts"
+
+# Placeholder scripts also tell the author/generator how the executor calls the stage
+STAGE_SCRIPT_TEMPLATES = {
+    "single": "# Generated script will go here\n",
+    "row_wise": (
+        "# Row-wise stage: the executor runs this script once per partition of the input CSV.\n"
+        "#   sys.argv[1] - input CSV (header + a subset of rows); read it sequentially, it may be a pipe\n"
+        "#   sys.argv[2] - output CSV to write (with header); partition outputs are concatenated\n"
+        "# Generated script will go here\n"
+    ),
+    "partitioned": (
+        "# Partitioned stage: the executor runs this script once per partition of the input CSV.\n"
+        "#   sys.argv[1] - input CSV (header + a subset of rows); read it sequentially, it may be a pipe\n"
+        "#   sys.argv[2] - output CSV to write for this partition\n"
+        "# Partition outputs are merged by the stage's reduce script, called as\n"
+        "#   python reduce.py <output_path> <part_output> [<part_output> ...]\n"
+        "# or concatenated when no reduce script is set.\n"
+        "# Generated script will go here\n"
+    ),
+}
+
 class PipelineStageCreate(BaseModel):
     stage_name: str
     user_prompt: str
+    execution_mode: str = "single"
+    reduce_script: Optional[str] = None
 
 @app.post("/pipeline_stage/{project_id}")
 async def create_pipeline_stage(
@@ -201,6 +316,10 @@ async def create_pipeline_stage(
     project = db.query(Project).filter(Project.project_id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    if pipeline.execution_mode not in STAGE_EXECUTION_MODES:
+        raise HTTPException(status_code=400, detail="Invalid execution mode")
+    if pipeline.reduce_script and pipeline.execution_mode != "partitioned":
+        raise HTTPException(status_code=400, detail="A reduce script is only valid for partitioned stages")
 
     try:
 
@@ -209,9 +328,11 @@ async def create_pipeline_stage(
             stage_name=pipeline.stage_name,
             stage_type="user_defined",
             user_prompt=pipeline.user_prompt,
-            script="# Generated script will go here",
+            script=STAGE_SCRIPT_TEMPLATES[pipeline.execution_mode],
             script_language="python",
-            docker_image="default-executor"
+            docker_image="default-executor",
+            execution_mode=pipeline.execution_mode,
+            reduce_script=pipeline.reduce_script
         )
         db.add(new_stage)
         db.commit()
@@ -234,13 +355,48 @@ async def create_pipeline_stage(
             "message": "Pipeline stage created successfully",
             # Return the new_stage.id, which is "PIP0001" style
             "stage_id": new_stage.id,
-            "stage_name": new_stage.stage_name
+            "stage_name": new_stage.stage_name,
+            "execution_mode": new_stage.execution_mode
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create pipeline stage: {str(e)}")
 
 
+class StageExecutionRequest(BaseModel):
+    input_path: str
+    output_path: str
+    partitions: Optional[int] = None
+
+@app.post("/pipeline_stage/{stage_id}/prepare_execution")
+def prepare_stage_execution(stage_id: str, request: StageExecutionRequest, db: Session = Depends(get_db)):
+    stage = db.query(PipelineStage).filter(PipelineStage.id == stage_id).first()
+    if not stage:
+        raise HTTPException(status_code=404, detail="Pipeline stage not found")
+
+    # Write the stage (and reduce) scripts to the shared folder for the executor
+    os.makedirs(SCRIPTS_DIR, exist_ok=True)
+    script_path = os.path.join(SCRIPTS_DIR, f"{stage.id}.py")
+    with open(script_path, "w") as f:
+        f.write(stage.script)
+
+    command = [
+        "python", "run_script.py", script_path,
+        "--mode", stage.execution_mode,
+        "--input", request.input_path,
+        "--output", request.output_path,
+    ]
+    if stage.execution_mode != "single" and request.partitions:
+        command += ["--partitions", str(request.partitions)]
+    if stage.execution_mode == "partitioned" and stage.reduce_script:
+        reduce_path = os.path.join(SCRIPTS_DIR, f"{stage.id}_reduce.py")
+        with open(reduce_path, "w") as f:
+            f.write(stage.reduce_script)
+        command += ["--reduce", reduce_path]
+
+    return {"stage_id": stage.id, "execution_mode": stage.execution_mode, "command": command}
+
+
 # New Endpoint: Get Graph Nodes for a Project
 @app.get("/nodes/{project_id}")
 def get_nodes(project_id: str, db: Session = Depends(get_db)):
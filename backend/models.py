@@ -75,6 +75,7 @@ class DataProfile(Base):
     file_path = Column(String(500), nullable=False)
     file_size = Column(BigInteger, nullable=False)
     record_count = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the stored object
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     project_id = Column(String(255), ForeignKey("projects.project_id"), nullable=False)
@@ -160,6 +161,8 @@ class PipelineStage(Base):
     script = Column(Text, nullable=False)
     script_language = Column(String(50), nullable=False)
     docker_image = Column(String(255), nullable=False)
+    execution_mode = Column(String(50), default="single", nullable=False)  # single, row_wise, partitioned
+    reduce_script = Column(Text, nullable=True)  # Merges partition outputs for partitioned stages
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Add this relationship so that the back_populates matches Project.pipeline_stages:
@@ -227,8 +230,20 @@ attach_id_generator(DataNode, "id", "DAT")
 attach_id_generator(PipelineNode, "id", "PIP")
 attach_id_generator(PipelineStage, "id", "PS")
 
+# create_all only creates missing tables, so columns added to existing
+# tables are applied here for databases created by an earlier version.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE pipeline_stage ADD COLUMN IF NOT EXISTS execution_mode VARCHAR(50) NOT NULL DEFAULT 'single'",
+    "ALTER TABLE pipeline_stage ADD COLUMN IF NOT EXISTS reduce_script TEXT",
+    "ALTER TABLE data_profiles ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_data_profiles_content_hash ON data_profiles (content_hash)",
+]
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
 
 
 
@@ -1,16 +1,256 @@
 # execution/run_script.py
+"""Run a pipeline stage script.
+
+Usage:
+    python run_script.py <script> [--mode single|row_wise|partitioned]
+                         [--input PATH] [--output PATH]
+                         [--partitions N] [--reduce <reduce_script>]
+
+Stage script contract:
+    single       python <script> [input_path] [output_path]
+    row_wise     python <script> <input_path> <output_path>
+                 argv[1] is a CSV (header + a subset of rows) to read,
+                 argv[2] is the CSV file the script must write. The
+                 partition outputs are concatenated, keeping one header.
+    partitioned  same as row_wise, but the outputs are merged by
+                 python <reduce_script> <output_path> <part_output>...
+                 when a reduce script is given.
+
+Partition inputs are streamed to the script through a pipe, so argv[1] may
+not be seekable; read it sequentially. The splitter cuts on line breaks, so
+a quoted field containing a newline can be split across partitions. This is
+detected while streaming (a partition with an odd number of quote
+characters) and the stage is then re-run as a single partition.
+"""
 import os
 import sys
+import shutil
+import argparse
+import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Stage execution modes (mirrors PipelineStage.execution_mode in the backend)
+SINGLE = "single"
+ROW_WISE = "row_wise"
+PARTITIONED = "partitioned"
+
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def compute_partitions(input_path, num_partitions):
+    """Split a CSV file into byte ranges aligned to line boundaries.
+
+    Returns the header line and a list of (start, end) byte offsets covering
+    every data row exactly once. A file without data rows yields a single
+    empty range so the stage still runs once and writes its header.
+    """
+    file_size = os.path.getsize(input_path)
+    with open(input_path, "rb") as f:
+        header = f.readline()
+        data_start = f.tell()
+        chunk = max(1, (file_size - data_start) // num_partitions)
+
+        offsets = [data_start]
+        for i in range(1, num_partitions):
+            target = data_start + i * chunk
+            if target <= offsets[-1]:
+                continue
+            f.seek(target - 1)
+            # Move to the start of the next full line
+            f.readline()
+            pos = f.tell()
+            if pos >= file_size:
+                break
+            if pos > offsets[-1]:
+                offsets.append(pos)
+        offsets.append(file_size)
+
+    ranges = [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+    if not ranges:
+        ranges = [(data_start, data_start)]
+    return header, ranges
+
+
+def stream_range(input_path, header, start, end, pipe):
+    """Write the header followed by bytes [start, end) of the input to a pipe.
+
+    Returns False when the range holds an odd number of quote characters,
+    i.e. it ends inside a quoted field that spans a line break.
+    """
+    quotes = 0
+    try:
+        pipe.write(header)
+        with open(input_path, "rb") as src:
+            src.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = src.read(min(remaining, COPY_BLOCK_SIZE))
+                if not block:
+                    break
+                quotes += block.count(b'"')
+                pipe.write(block)
+                remaining -= len(block)
+    except BrokenPipeError:
+        # The script stopped reading early; its exit code reports the outcome
+        return True
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+    return quotes % 2 == 0
+
+
+def run_partition(script_path, input_path, header, start, end, work_dir, index):
+    """Run the stage script on one partition, streaming its rows over stdin."""
+    part_output = os.path.join(work_dir, f"part-{index:05d}.output.csv")
+    stdout_path = os.path.join(work_dir, f"part-{index:05d}.stdout")
+    stderr_path = os.path.join(work_dir, f"part-{index:05d}.stderr")
+
+    with open(stdout_path, "w") as stdout, open(stderr_path, "w") as stderr:
+        process = subprocess.Popen(
+            ["python", script_path, "/dev/stdin", part_output],
+            stdin=subprocess.PIPE,
+            stdout=stdout,
+            stderr=stderr,
+        )
+        balanced = stream_range(input_path, header, start, end, process.stdin)
+        returncode = process.wait()
+
+    with open(stdout_path) as stdout, open(stderr_path) as stderr:
+        return index, part_output, returncode, balanced, stdout.read(), stderr.read()
+
+
+def run_ranges(script_path, input_path, header, ranges, work_dir):
+    # Each partition runs in its own child process; threads only feed and wait on them
+    max_workers = min(len(ranges), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(run_partition, script_path, input_path, header, start, end, work_dir, i)
+            for i, (start, end) in enumerate(ranges)
+        ]
+        return sorted(future.result() for future in futures)
+
+
+def concatenate_outputs(part_outputs, output_path):
+    """Concatenate CSV partition outputs, keeping only the first header.
+
+    Every part is terminated with a newline so that a part without a
+    trailing newline is not glued onto the next part's first row.
+    """
+    with open(output_path, "wb") as dst:
+        last_byte = b"\n"
+        for i, part_output in enumerate(part_outputs):
+            with open(part_output, "rb") as src:
+                header = src.readline()
+                if i == 0 and header:
+                    dst.write(header)
+                    last_byte = header[-1:]
+                for block in iter(lambda: src.read(COPY_BLOCK_SIZE), b""):
+                    dst.write(block)
+                    last_byte = block[-1:]
+            if last_byte != b"\n":
+                dst.write(b"\n")
+                last_byte = b"\n"
+
+
+def run_partitioned(script_path, input_path, output_path, mode, num_partitions, reduce_script=None):
+    header, ranges = compute_partitions(input_path, num_partitions)
+    work_dir = tempfile.mkdtemp(prefix="stage-partitions-")
+
+    try:
+        results = None
+        if header.count(b'"') % 2 == 0:
+            results = run_ranges(script_path, input_path, header, ranges, work_dir)
+        if results is None or not all(result[3] for result in results):
+            # A quoted field spans a line break at a partition boundary: the
+            # splitter cannot cut this file safely, so run it as one partition
+            print("Warning: quoted newline crosses a partition boundary; re-running as a single partition")
+            single_dir = os.path.join(work_dir, "single")
+            os.makedirs(single_dir)
+            results = run_ranges(script_path, input_path, header, [(ranges[0][0], ranges[-1][1])], single_dir)
+
+        failed = False
+        part_outputs = []
+        for index, part_output, returncode, balanced, stdout, stderr in results:
+            print(f"Partition {index} output:\n", stdout)
+            print(f"Partition {index} errors:\n", stderr)
+            if returncode != 0:
+                print(f"Error: partition {index} exited with code {returncode}")
+                failed = True
+            elif not os.path.exists(part_output):
+                print(f"Error: partition {index} did not write {part_output}")
+                failed = True
+            part_outputs.append(part_output)
+
+        if failed:
+            print("Error: one or more partitions failed")
+            return 1
+
+        if mode == PARTITIONED and reduce_script:
+            # User-supplied reduce step: receives the final output path followed by every partition output
+            result = subprocess.run(
+                ["python", reduce_script, output_path] + part_outputs,
+                capture_output=True,
+                text=True,
+            )
+            print("Reduce output:\n", result.stdout)
+            print("Reduce errors:\n", result.stderr)
+            return result.returncode
+
+        concatenate_outputs(part_outputs, output_path)
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a pipeline stage script")
+    # Expect the script path as the first argument; default if none is provided
+    parser.add_argument("script_path", nargs="?", default="generated_script.py")
+    parser.add_argument("--mode", choices=[SINGLE, ROW_WISE, PARTITIONED], default=SINGLE)
+    parser.add_argument("--input", dest="input_path")
+    parser.add_argument("--output", dest="output_path")
+    parser.add_argument("--partitions", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--reduce", dest="reduce_script")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.script_path):
+        print(f"Error: {args.script_path} does not exist")
+        sys.exit(1)
+
+    if args.mode == SINGLE:
+        # Execute the script and print its output and errors
+        command = ["python", args.script_path]
+        if args.input_path:
+            command.append(args.input_path)
+        if args.output_path:
+            command.append(args.output_path)
+        result = subprocess.run(command, capture_output=True, text=True)
+        print("Output:\n", result.stdout)
+        print("Errors:\n", result.stderr)
+        return
+
+    if not args.input_path or not args.output_path:
+        print(f"Error: --input and --output are required for {args.mode} stages")
+        sys.exit(1)
+    if not os.path.exists(args.input_path):
+        print(f"Error: {args.input_path} does not exist")
+        sys.exit(1)
+    if args.reduce_script and not os.path.exists(args.reduce_script):
+        print(f"Error: {args.reduce_script} does not exist")
+        sys.exit(1)
 
-# Expect the script path as the first argument; default if none is provided
-script_path = sys.argv[1] if len(sys.argv) > 1 else "generated_script.py"
+    sys.exit(run_partitioned(
+        args.script_path,
+        args.input_path,
+        args.output_path,
+        args.mode,
+        max(1, args.partitions),
+        args.reduce_script,
+    ))
 
-if not os.path.exists(script_path):
-    print(f"Error: {script_path} does not exist")
-    sys.exit(1)
 
-# Execute the script and print its output and errors
-result = subprocess.run(["python", script_path], capture_output=True, text=True)
-print("Output:\n", result.stdout)
-print("Errors:\n", result.stderr)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# execution/test_run_script.py
+import csv
+
+from run_script import ROW_WISE, compute_partitions, concatenate_outputs, run_partitioned
+
+# Row-wise stage that copies its input and leaves the output without a trailing newline
+COPY_STAGE = """import sys
+with open(sys.argv[1]) as src:
+    rows = src.read().splitlines()
+with open(sys.argv[2], "w") as dst:
+    dst.write("\\n".join(rows))
+"""
+
+
+def write(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+
+def read_ranges(path, header, ranges):
+    data = open(path, "rb").read()
+    return header + b"".join(data[start:end] for start, end in ranges)
+
+
+def test_partitions_cover_file_without_trailing_newline(tmp_path):
+    path = write(tmp_path / "in.csv", b"a,b\n1,2\n3,4\n5,6")
+    header, ranges = compute_partitions(path, 2)
+    assert header == b"a,b\n"
+    assert read_ranges(path, header, ranges) == b"a,b\n1,2\n3,4\n5,6"
+
+
+def test_header_only_input_yields_one_empty_partition(tmp_path):
+    path = write(tmp_path / "in.csv", b"a,b\n")
+    header, ranges = compute_partitions(path, 4)
+    assert header == b"a,b\n"
+    assert ranges == [(4, 4)]
+
+
+def test_more_partitions_than_rows(tmp_path):
+    path = write(tmp_path / "in.csv", b"a,b\n1,2\n3,4\n")
+    header, ranges = compute_partitions(path, 50)
+    assert len(ranges) <= 2
+    assert read_ranges(path, header, ranges) == b"a,b\n1,2\n3,4\n"
+
+
+def test_concatenate_terminates_parts_without_newline(tmp_path):
+    parts = [
+        write(tmp_path / "p0.csv", b"a,b\n1,2"),
+        write(tmp_path / "p1.csv", b"a,b"),
+        write(tmp_path / "p2.csv", b"a,b\n3,4"),
+    ]
+    output = str(tmp_path / "out.csv")
+    concatenate_outputs(parts, output)
+    assert open(output, "rb").read() == b"a,b\n1,2\n3,4\n"
+
+
+def test_concatenate_header_only_part(tmp_path):
+    parts = [write(tmp_path / "p0.csv", b"a,b")]
+    output = str(tmp_path / "out.csv")
+    concatenate_outputs(parts, output)
+    assert open(output, "rb").read() == b"a,b\n"
+
+
+def test_row_wise_stage_keeps_rows_intact(tmp_path):
+    rows = [f"{i},{'x' * 20}" for i in range(1000)]
+    path = write(tmp_path / "in.csv", ("a,b\n" + "\n".join(rows)).encode())
+    script = write(tmp_path / "stage.py", COPY_STAGE.encode())
+    output = str(tmp_path / "out.csv")
+
+    assert run_partitioned(script, path, output, ROW_WISE, 8) == 0
+    with open(output, newline="") as f:
+        result = list(csv.reader(f))
+    assert result == [["a", "b"]] + [row.split(",") for row in rows]
+
+
+def test_quoted_newline_falls_back_to_single_partition(tmp_path):
+    rows = [f'{i},"line one\nline two"' for i in range(200)]
+    path = write(tmp_path / "in.csv", ("a,b\n" + "\n".join(rows) + "\n").encode())
+    script = write(tmp_path / "stage.py", COPY_STAGE.encode())
+    output = str(tmp_path / "out.csv")
+
+    assert run_partitioned(script, path, output, ROW_WISE, 8) == 0
+    with open(output, newline="") as f:
+        result = list(csv.reader(f))
+    assert result == [["a", "b"]] + [[str(i), "line one\nline two"] for i in range(200)]